@@ -26,6 +26,15 @@ def parse_args():
         help="Número máximo de webs a crawlear.",
     )
 
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=16,
+        help="Número de descargas simultáneas. Valores muy altos saturan"
+             " el servidor y provocan timeouts.",
+    )
+
     parser.add_argument(
         "-o", 
         "--output-folder",
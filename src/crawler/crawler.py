@@ -1,103 +1,294 @@
+import html
+import re
 import requests
 import os
-import json
+import shutil
+import sqlite3
+import threading
 import pdfplumber
 from argparse import Namespace
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
 from queue import Queue
-from typing import Set
+from time import time
+from typing import Dict, List, Optional, Set, Tuple
 from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
 from urllib.parse import urljoin
+from urllib3.util.retry import Retry
+
+try:
+    import xxhash
+
+    HAVE_XXHASH = True
+except ImportError:  # xxhash es opcional, se usa el hash de Python
+    HAVE_XXHASH = False
+
+# Basta con buscar la etiqueta <title> en los bytes de la respuesta, sin
+# construir el árbol HTML completo
+_TITLE_RE = re.compile(rb"<title[^>]*>([^<]+)</title>", re.IGNORECASE)
+
+# Número de páginas entre cada commit a la base de datos
+_COMMIT_EVERY = 50
+
+_CREATE_PAGES = """
+CREATE TABLE IF NOT EXISTS pages (
+    url TEXT PRIMARY KEY,
+    fetched_at INTEGER NOT NULL,
+    type TEXT NOT NULL,
+    title TEXT NOT NULL,
+    etag TEXT NOT NULL,
+    last_modified TEXT NOT NULL,
+    text TEXT NOT NULL
+)
+"""
+
+
+def _url_key(url: str) -> int:
+    """Huella de 64 bits de una URL. Guardar la huella en lugar de la URL
+    completa reduce el coste de cada entrada del conjunto de visitadas."""
+    if HAVE_XXHASH:
+        return xxhash.xxh64_intdigest(url.encode())
+    return hash(url)
+
 
 class Crawler:
     def __init__(self, args: Namespace):
         self.args = args
-        self.visited_urls = set()
+        self.visited_hashes: Set[int] = set()
+        self.session = self._build_session()
+        self.pages_filename = os.path.join(self.args.output_folder, "pages.db")
+        # Validadores HTTP de las páginas ya guardadas: URL -> (ETag, Last-Modified)
+        self.previous_pages: Dict[str, Tuple[str, str]] = {}
+        # Conexión de solo lectura de cada hilo del pool. Se guardan todas para
+        # cerrarlas desde el hilo principal al terminar
+        self._local = threading.local()
+        self._readers: List[sqlite3.Connection] = []
+        self._readers_lock = threading.Lock()
+
+    def _build_session(self) -> requests.Session:
+        """Crea una sesión HTTP reutilizable para mantener vivas las conexiones
+        (keep-alive) y no repetir el handshake TCP+TLS en cada petición."""
+        session = requests.Session()
+        session.headers["User-Agent"] = "SearchEngine-Crawler/1.0"
+        # requests descomprime la respuesta automáticamente
+        session.headers["Accept-Encoding"] = "gzip, deflate"
+        # Una conexión por hilo de descarga, para que ningún hilo tenga que
+        # esperar a que otro libere la suya
+        adapter = HTTPAdapter(
+            pool_connections=4,
+            pool_maxsize=max(self.args.workers, 1),
+            max_retries=Retry(
+                total=2,
+                backoff_factor=0.3,
+                status_forcelist=[429, 500, 502, 503, 504],
+            ),
+        )
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
 
     def crawl(self) -> None:
-        queue = Queue()
-        visited_urls = set()
+        queue: "Queue[str]" = Queue()
         queue.put(self.args.url)
-        processed_urls = []
+        n_processed = 0
+        pending: Dict[Future, str] = {}  # Peticiones en curso: Future -> URL
 
-        while not queue.empty() and len(visited_urls) < self.args.max_webs:
-            current_url = queue.get()
+        # Todas las páginas se guardan en una única base de datos SQLite, en
+        # lugar de un fichero por página o un JSON gigante al final
+        os.makedirs(self.args.output_folder, exist_ok=True)
+        connection = self.connect_pages()
+        self.load_previous_pages(connection)
+        # URLs procesadas en esta ejecución, para descartar al final las demás.
+        # Es una tabla temporal: solo existe en esta conexión y se borra al cerrarla
+        connection.execute("CREATE TEMP TABLE seen_pages (url TEXT PRIMARY KEY)")
 
-            if current_url in visited_urls:
-                continue
+        # Las descargas se reparten entre un pool de hilos que comparten la
+        # sesión HTTP; el hilo principal es el único que toca la cola, el
+        # conjunto de visitadas y la base de datos.
+        with ThreadPoolExecutor(max_workers=self.args.workers) as executor:
+            while (not queue.empty() or pending) and n_processed < self.args.max_webs:
+                # Rellenar el pool sin pasarse del número máximo de webs
+                while (
+                    not queue.empty()
+                    and len(pending) < self.args.workers
+                    and n_processed + len(pending) < self.args.max_webs
+                ):
+                    current_url = queue.get()
+                    url_key = _url_key(current_url)
+                    if url_key not in self.visited_hashes:
+                        self.visited_hashes.add(url_key)
+                        pending[executor.submit(self.fetch, current_url)] = current_url
 
-            try:
-                response = requests.get(current_url)
-                if response.status_code == 200:
-                    html_content = response.text
-                    new_urls = self.find_urls(current_url, html_content)
-                    #print(f"Nuevas URLs encontradas: {new_urls}")
+                if not pending:
+                    break
 
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    del pending[future]
+                    result = future.result()
+                    if result is None:
+                        continue
+
+                    data, new_urls, modified = result
                     for new_url in new_urls:
-                        if new_url not in visited_urls:
+                        url_key = _url_key(new_url)
+                        if url_key in self.visited_hashes:
+                            continue
+                        if new_url.endswith(".pdf"):
+                            # Los PDFs se descargan una sola vez, aunque los
+                            # enlacen varias páginas, y no cuentan como webs
+                            self.visited_hashes.add(url_key)
+                            pdf_filename = os.path.join(self.args.output_folder, os.path.basename(new_url))
+                            executor.submit(self.download_pdf, data["url"], new_url, pdf_filename)
+                            print(f"Nueva URL de PDF descubierta: {new_url}")
+                        else:
                             queue.put(new_url)
                             #print(f"Nueva URL descubierta: {new_url}")
 
-                    data = {"url": current_url, "text": html_content}
-                    if current_url.endswith(".pdf"):
-                        pdf_filename = os.path.join(self.args.output_folder, os.path.basename(current_url))
-                        data["type"] = "pdf"
-                        data["title"] = ""  #Extraer el título del PDF si es posible
-                        self.download_pdf(current_url, pdf_filename)
+                    if modified:
+                        connection.execute(
+                            "INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?, ?)",
+                            (data["url"], int(time()), data["type"], data["title"],
+                             data["etag"], data["last_modified"], data["text"]),
+                        )
                     else:
-                        data["type"] = "url"
-                        data["title"] = ""  #Extraer el título de la página si es posible
+                        connection.execute(
+                            "UPDATE pages SET fetched_at = ? WHERE url = ?", (int(time()), data["url"])
+                        )
+                    connection.execute("INSERT OR IGNORE INTO seen_pages VALUES (?)", (data["url"],))
+                    n_processed += 1
+                    if n_processed % _COMMIT_EVERY == 0:
+                        connection.commit()
+                    print(f"Total URLs procesadas: {n_processed}")
 
-                    processed_urls.append(data)
-                    visited_urls.add(current_url)
-                    print(f"Total URLs procesadas: {len(visited_urls)}")
+        # Descartar las páginas de ejecuciones anteriores que ya no se han visitado
+        connection.execute("DELETE FROM pages WHERE url NOT IN (SELECT url FROM seen_pages)")
+        connection.commit()
+        connection.close()
+        for reader in self._readers:
+            reader.close()
+        self._readers.clear()
 
-            except Exception as e:
-                print(f"Error al procesar {current_url}: {type(e).__name__} - {str(e)}")
+    def connect_pages(self) -> sqlite3.Connection:
+        """Abre la base de datos de páginas. WAL permite que los hilos del pool
+        lean mientras el hilo principal escribe."""
+        connection = sqlite3.connect(self.pages_filename)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute(_CREATE_PAGES)
+        return connection
 
-        processed_urls_filename = os.path.join(self.args.output_folder, "processed_urls.json")
-        with open(processed_urls_filename, 'w', encoding='utf-8') as file:
-            json.dump(processed_urls, file, ensure_ascii=False, indent=4)
+    def load_previous_pages(self, connection: sqlite3.Connection) -> None:
+        """Carga los validadores HTTP (ETag / Last-Modified) de las páginas
+        guardadas para hacer peticiones condicionales."""
+        for url, etag, last_modified in connection.execute(
+            "SELECT url, etag, last_modified FROM pages"
+        ):
+            self.previous_pages[url] = (etag, last_modified)
 
-    def find_urls(self, base_url: str, text: str) -> Set[str]:
-        soup = BeautifulSoup(text, 'html.parser')
-        urls = set()
+    def read_previous_page(self, url: str) -> Dict[str, str]:
+        """Lee los datos guardados de una página en una ejecución anterior.
+        Se ejecuta dentro del pool de hilos."""
+        reader = getattr(self._local, "connection", None)
+        if reader is None:
+            # Cada conexión solo la usa su hilo, pero se cierra desde el principal
+            reader = self._local.connection = sqlite3.connect(
+                self.pages_filename, check_same_thread=False
+            )
+            with self._readers_lock:
+                self._readers.append(reader)
+        page_type, title, text = reader.execute(
+            "SELECT type, title, text FROM pages WHERE url = ?", (url,)
+        ).fetchone()
+        return {"url": url, "type": page_type, "title": title, "text": text}
+
+    def fetch(self, current_url: str) -> Optional[Tuple[Dict[str, str], Set[str], bool]]:
+        """Descarga una URL y devuelve sus datos, las URLs que enlaza y si ha
+        cambiado desde la última descarga. Se ejecuta dentro del pool de hilos."""
+        try:
+            # Petición condicional si ya se descargó en la ejecución anterior
+            headers = {}
+            previous = self.previous_pages.get(current_url)
+            if previous is not None:
+                etag, last_modified = previous
+                if etag:
+                    headers["If-None-Match"] = etag
+                if last_modified:
+                    headers["If-Modified-Since"] = last_modified
 
-        for a_tag in soup.find_all('a', href=True):
-            href = a_tag['href']
+            response = self.session.get(current_url, headers=headers, timeout=(5, 30))
+            if response.status_code == 304:
+                # No ha cambiado: se reutiliza la copia anterior sin descargarla
+                data = self.read_previous_page(current_url)
+                return data, self.find_urls(current_url, data["text"]), False
+            if response.status_code != 200:
+                return None
 
-            if href.startswith("https://universidadeuropea.com/") and href not in self.visited_urls:
-                urls.add(href)
+            html_content = response.text
+            new_urls = self.find_urls(current_url, html_content)
+            #print(f"Nuevas URLs encontradas: {new_urls}")
 
-                if href.endswith(".pdf"):
-                    pdf_filename = os.path.join(self.args.output_folder, os.path.basename(href))
-                    self.download_pdf(base_url, href, pdf_filename)
+            data = {
+                "url": current_url,
+                "text": html_content,
+                "etag": response.headers.get("ETag", ""),
+                "last_modified": response.headers.get("Last-Modified", ""),
+            }
+            if current_url.endswith(".pdf"):
+                pdf_filename = os.path.join(self.args.output_folder, os.path.basename(current_url))
+                data["type"] = "pdf"
+                data["title"] = ""  #Extraer el título del PDF si es posible
+                self.download_pdf(current_url, current_url, pdf_filename)
+            else:
+                data["type"] = "url"
+                data["title"] = self.extract_title(response.content)
+            return data, new_urls, True
 
-                    # Agrega la URL del PDF al conjunto de URLs visitadas
-                    self.visited_urls.add(href)
-                    print(f"Nueva URL de PDF descubierta: {href}")
+        except Exception as e:
+            print(f"Error al procesar {current_url}: {type(e).__name__} - {str(e)}")
+            return None
+
+    def extract_title(self, content: bytes) -> str:
+        """Extrae el título de una página HTML."""
+        match = _TITLE_RE.search(content)
+        if match is None:
+            return ""
+        title = match.group(1).decode("utf-8", errors="ignore")
+        return " ".join(html.unescape(title).split())
+
+    def find_urls(self, base_url: str, text: str) -> Set[str]:
+        """Devuelve las URLs del dominio enlazadas desde una página. Se ejecuta
+        dentro del pool de hilos, así que no consulta las URLs visitadas ni
+        descarga nada: de eso se encarga el hilo principal."""
+        soup = BeautifulSoup(text, 'lxml')
 
-        return urls
+        # El selector filtra por prefijo dentro del motor de selección, sin
+        # recorrer en Python todos los enlaces de la página
+        return {
+            a_tag['href']
+            for a_tag in soup.select('a[href^="https://universidadeuropea.com/"]')
+        }
     
     def download_pdf(self, base_url: str, pdf_url: str, pdf_filename: str) -> None:
         try:
             # Construir correctamente la URL del PDF
             pdf_url = urljoin(base_url, pdf_url)
 
-            response = requests.get(pdf_url, stream=True)
+            response = self.session.get(pdf_url, stream=True, timeout=(5, 60))
 
             # Utilizar os.path.join para obtener la ruta completa del archivo PDF
             pdf_filename = os.path.join(self.args.output_folder, os.path.basename(pdf_url))
 
+            # Copiar la respuesta en bloques de 1 MB en lugar de 1 KB para
+            # reducir el número de llamadas al sistema por PDF
+            response.raw.decode_content = True
             with open(pdf_filename, 'wb') as pdf_file:
-                for chunk in response.iter_content(chunk_size=1024):
-                    if chunk:
-                        pdf_file.write(chunk)
+                shutil.copyfileobj(response.raw, pdf_file, length=1 << 20)
 
-            # Extraer texto del archivo pdf
+            # Extraer texto del archivo pdf. El indexer reutiliza este .txt en
+            # lugar de volver a procesar el PDF
             with pdfplumber.open(pdf_filename) as pdf:
-                text = ""
-                for page in pdf.pages:
-                    text += page.extract_text()
+                text = "".join(page.extract_text() or "" for page in pdf.pages)
 
             # Guardar el texto extraido como archivo txt
             text_filename = os.path.splitext(pdf_filename)[0] + ".txt"
@@ -29,6 +29,16 @@ def parse_args():
         required=True,
     )
 
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=None,
+        help="Número de procesos para analizar los documentos"
+        " (por defecto, uno por CPU)",
+        required=False,
+    )
+
     # Añade aquí cualquier otro argumento que condicione
     # el funcionamiento del indexer
     return parser.parse_args()
@@ -1,33 +1,252 @@
 from argparse import ArgumentParser
+from array import array
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 from dataclasses import dataclass, field
-from typing import Dict, List
+from functools import partial
+from typing import Any, DefaultDict, Iterator, List, Mapping, Optional, Sequence, Tuple
+import mmap
 import os
 import json
+import re
+import sqlite3
 import string
-from bs4 import BeautifulSoup
+import struct
+import sys
 from time import time
 from tqdm import tqdm
-import pickle as pkl
 from nltk.corpus import stopwords
+from selectolax.lexbor import LexborHTMLParser
 from unidecode import unidecode
 import pdfplumber
 
+try:
+    import orjson
+
+    HAVE_ORJSON = True
+except ImportError:  # orjson es opcional, se usa json de la librería estándar
+    HAVE_ORJSON = False
+
+try:
+    import numpy as np
+
+    HAVE_NUMPY = True
+except ImportError:  # numpy es opcional, las postings se decodifican en Python
+    HAVE_NUMPY = False
+
+# Cabecera del fichero de índice: identificador de formato, nº de términos y
+# tamaño en bytes de los bloques de postings, términos, documentos y textos.
+# Le siguen, en este orden, los offsets de cada posting list (uint64, en bytes),
+# las postings comprimidas con VByte y los tres bloques JSON. El texto completo
+# de los documentos va aparte, al final, para poder cargar el índice sin él.
+# Todo en el orden de bytes nativo de la máquina.
+_INDEX_MAGIC = b"SEIDX003"
+_INDEX_HEADER = struct.Struct("=8sQQQQQ")
+
+# Palabras formadas solo por letras: descarta en una única pasada los signos
+# de puntuación, los dígitos y cualquier separador (espacios, saltos de línea...)
+_TOKEN_RE = re.compile(r"[^\W\d_]+")
+
+# Tabla para quitar las tildes de todo el texto con un único str.translate
+# (á -> a, ñ -> n, ç -> c...). Se construye con unidecode una sola vez, en
+# lugar de llamar a unidecode palabra a palabra. Solo cubre letras: el resto
+# de símbolos los descarta después la expresión regular de tokenizado
+_FOLD = {
+    ord(char): unidecode(char).lower()
+    for char in map(chr, range(0x80, 0x300))
+    if char.isalpha()
+}
+# Las tildes sueltas (marcas combinantes, U+0300-U+036F) se eliminan: algunos
+# textos vienen descompuestos (NFD), con "í" escrita como "i" + U+0301
+_FOLD.update(dict.fromkeys(range(0x300, 0x370)))
+
+
+def fold(text: str) -> str:
+    """Pasa un texto a minúsculas y le quita las tildes. Se usa tanto al
+    indexar como al normalizar los términos de las queries."""
+    return text.lower().translate(_FOLD)
+
+
+# Stopwords normalizadas igual que los tokens. Se calculan una sola vez al
+# importar el módulo en lugar de recargar el corpus de NLTK por documento
+_STOPWORDS = frozenset(fold(word) for word in stopwords.words("spanish"))
+
+
+def _json_dumps(obj: Any) -> bytes:
+    if HAVE_ORJSON:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False).encode("utf-8")
+
+
+def _json_loads(data: bytes) -> Any:
+    if HAVE_ORJSON:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+class _Postings(Mapping[str, array]):
+    """Posting lists de un índice cargado de disco. Cada lista se corta del
+    mapeo en memoria y se descomprime solo cuando se pide, así que cargar el
+    índice no recorre los términos y solo se leen de disco las páginas de las
+    listas usadas."""
+
+    def __init__(self, terms: List[str], offsets: memoryview, flat_postings: memoryview):
+        self._positions = {term: i for i, term in enumerate(terms)}
+        self._offsets = offsets
+        self._flat_postings = flat_postings
+
+    def __getitem__(self, term: str) -> array:
+        i = self._positions[term]
+        return _vbyte_decode(self._flat_postings[self._offsets[i]:self._offsets[i + 1]])
+
+    def __contains__(self, term: object) -> bool:
+        return term in self._positions
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._positions)
+
+    def __len__(self) -> int:
+        return len(self._positions)
+
+
+def _vbyte_encode(posting: Sequence[int]) -> bytes:
+    """Comprime una posting list ordenada guardando la diferencia con el id
+    anterior en bloques de 7 bits. El último byte de cada número lleva el bit
+    alto activo para marcar su final."""
+    encoded = bytearray()
+    previous = 0
+    for doc_id in posting:
+        gap = doc_id - previous
+        previous = doc_id
+        while gap >= 0x80:
+            encoded.append(gap & 0x7F)
+            gap >>= 7
+        encoded.append(gap | 0x80)
+    return bytes(encoded)
+
+
+def _vbyte_decode(data: memoryview) -> array:
+    """Descomprime una posting list guardada con _vbyte_encode. Devuelve un
+    array de uint32, el mismo tipo que las posting lists en construcción."""
+    posting = array("I")
+    if HAVE_NUMPY:
+        # Todos los bytes a la vez: cada uno se desplaza según su posición
+        # dentro del número al que pertenece, se suman por número y la suma
+        # acumulada de las diferencias da los doc ids
+        raw = np.frombuffer(data, dtype=np.uint8)
+        ends = np.flatnonzero(raw & 0x80)
+        starts = np.concatenate(([0], ends[:-1] + 1))
+        owner = np.repeat(np.arange(len(ends)), ends - starts + 1)
+        shifts = 7 * (np.arange(len(raw)) - starts[owner])
+        parts = (raw & 0x7F).astype(np.uint64) << shifts.astype(np.uint64)
+        gaps = np.bincount(owner, weights=parts, minlength=len(ends))
+        posting.frombytes(np.cumsum(gaps.astype(np.uint32), dtype=np.uint32).tobytes())
+        return posting
+    doc_id = gap = shift = 0
+    for byte in data:
+        gap |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            doc_id += gap
+            posting.append(doc_id)
+            gap = shift = 0
+        else:
+            shift += 7
+    return posting
+
+
 @dataclass
 class Document:
     id: int
     title: str
     url: str
     text: str
+    # Se calcula al construir el índice para no parsear el HTML en cada query
+    snippet: str = ""
+
 
 @dataclass
 class Index:
-    postings: Dict[str, List[int]] = field(default_factory=lambda: {})
+    # Cada posting list es un array de uint32 (4 bytes por id, sin un objeto
+    # int por elemento); en disco se guardan comprimidas con VByte. El Index
+    # solo las lee: al construirlo es el defaultdict del Indexer, que es quien
+    # las modifica; al cargarlo de disco, un _Postings de solo lectura
+    postings: Mapping[str, array] = field(default_factory=lambda: {})
     documents: List[Document] = field(default_factory=lambda: [])
 
     def save(self, output_folder: str, output_name: str) -> None:
+        """Guarda el índice en formato columnar: todas las posting lists
+        comprimidas y concatenadas en un único bloque más una tabla de offsets,
+        de forma que se pueden leer sin reconstruir objetos Python."""
         output_path = os.path.join(output_folder, output_name)
+        terms = sorted(self.postings)
+        offsets = array("Q", [0])
+        flat_postings = bytearray()
+        for term in terms:
+            flat_postings += _vbyte_encode(self.postings[term])
+            offsets.append(len(flat_postings))
+
+        terms_block = _json_dumps(terms)
+        documents_block = _json_dumps({
+            "id": [document.id for document in self.documents],
+            "title": [document.title for document in self.documents],
+            "url": [document.url for document in self.documents],
+            "snippet": [document.snippet for document in self.documents],
+        })
+        texts_block = _json_dumps([document.text for document in self.documents])
+
         with open(output_path, "wb") as fw:
-            pkl.dump(self, fw)
+            fw.write(_INDEX_HEADER.pack(
+                _INDEX_MAGIC, len(terms), len(flat_postings), len(terms_block),
+                len(documents_block), len(texts_block),
+            ))
+            offsets.tofile(fw)
+            fw.write(flat_postings)
+            fw.write(terms_block)
+            fw.write(documents_block)
+            fw.write(texts_block)
+
+    @classmethod
+    def load(cls, path: str, load_text: bool = True) -> "Index":
+        """Carga un índice guardado con save. El fichero se mapea en memoria
+        y cada posting list se descomprime de ese mapeo en un array nuevo cada
+        vez que se consulta, sin tocar las demás. Con load_text=False no se
+        lee el texto completo de los documentos, que es la mayor parte del
+        fichero, y los documentos quedan con el texto vacío."""
+        with open(path, "rb") as fr:
+            # El mapeo sigue siendo válido después de cerrar el fichero
+            buffer = mmap.mmap(fr.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, n_terms, postings_size, terms_size, documents_size, texts_size = (
+            _INDEX_HEADER.unpack_from(buffer)
+        )
+        if magic != _INDEX_MAGIC:
+            raise ValueError(f"{path} no es un fichero de índice válido")
+
+        view = memoryview(buffer)
+        start = _INDEX_HEADER.size
+        end = start + 8 * (n_terms + 1)
+        offsets = view[start:end].cast("Q")
+        start, end = end, end + postings_size
+        flat_postings = view[start:end]
+        start, end = end, end + terms_size
+        terms = _json_loads(buffer[start:end])
+        start, end = end, end + documents_size
+        columns = _json_loads(buffer[start:end])
+        if load_text:
+            start, end = end, end + texts_size
+            texts = _json_loads(buffer[start:end])
+        else:
+            texts = [""] * len(columns["id"])
+
+        postings = _Postings(terms, offsets, flat_postings)
+        documents = [
+            Document(id=doc_id, title=title, url=url, text=text, snippet=snippet)
+            for doc_id, title, url, text, snippet in zip(
+                columns["id"], columns["title"], columns["url"], texts, columns["snippet"]
+            )
+        ]
+        return cls(postings=postings, documents=documents)
+
 
 @dataclass
 class Stats:
@@ -42,25 +261,55 @@ class Stats:
             f"Time: {self.building_time}"
         )
 
+
+# Indexer propio de cada proceso del pool; se crea una vez por proceso en
+# _init_worker para no enviar el índice en construcción con cada tarea
+_worker_indexer: Optional["Indexer"] = None
+
+
+def _init_worker(args) -> None:
+    global _worker_indexer
+    _worker_indexer = Indexer(args)
+
+
+def _analyze(text: str) -> Tuple[List[str], str]:
+    assert _worker_indexer is not None, "_init_worker no se ha ejecutado"
+    return _worker_indexer.analyze(text)
+
+
 class Indexer:
     def __init__(self, args):
         self.args = args
-        self.index = Index()
+        # Posting lists en construcción; self.index guarda esta misma referencia
+        self.postings: DefaultDict[str, array] = defaultdict(partial(array, "I"))
+        self.index = Index(postings=self.postings)
         self.stats = Stats()
         self.failed_pdfs = []  # Añadir el atributo failed_pdfs
 
     def build_index(self) -> None:
         ts = time()
 
-        for filename in tqdm(os.listdir(self.args.input_folder), desc="Indexing"):
-            if filename.endswith(".json"):
-                self.process_json(filename)
+        # Leer los documentos y asignarles identificador
+        for filename in tqdm(os.listdir(self.args.input_folder), desc="Reading"):
+            if filename.endswith(".db"):
+                self.process_pages(filename)
             elif filename.endswith(".pdf"):
                 try:
                     self.process_pdf(filename)
                 except Exception as e:
                     print(f"Error al procesar PDF {filename}: {type(e).__name__} - {str(e)}")
 
+        # Extraer los términos de cada documento en paralelo (es la parte que
+        # más CPU consume) y actualizar las posting lists en orden de id
+        documents = self.index.documents
+        with ProcessPoolExecutor(
+            max_workers=self.args.workers, initializer=_init_worker, initargs=(self.args,)
+        ) as executor:
+            analyzed = executor.map(_analyze, [document.text for document in documents], chunksize=8)
+            for document, (terms, snippet) in tqdm(zip(documents, analyzed), total=len(documents), desc="Indexing"):
+                document.snippet = snippet
+                self.update_postings(document.id, terms)
+
         te = time()
 
         output_folder = "etc/indexes"
@@ -72,90 +321,99 @@ class Indexer:
     def process_pdf(self, filename: str) -> None:
         """Método para procesar archivos PDF."""
         pdf_path = os.path.join(self.args.input_folder, filename)
+        text_path = os.path.splitext(pdf_path)[0] + ".txt"
 
         try:
-            # Utilizar pdfplumber para extraer texto de PDF
-            with pdfplumber.open(pdf_path) as pdf_document:
-                text = ""
-                for page in pdf_document.pages:
-                    text += page.extract_text()
+            if os.path.exists(text_path):
+                # El crawler ya extrajo el texto al descargar el PDF
+                with open(text_path, "r", encoding="utf-8") as text_file:
+                    text = text_file.read()
+                title = ""
+            else:
+                # Utilizar pdfplumber para extraer texto de PDF
+                with pdfplumber.open(pdf_path) as pdf_document:
+                    text = "".join(page.extract_text() or "" for page in pdf_document.pages)
 
-                # Utilizar PyMuPDF para extraer el título del PDF
-                metadata = pdf_document.metadata
-                title = metadata.get("title", "")
+                    # Utilizar los metadatos para extraer el título del PDF
+                    metadata = pdf_document.metadata
+                    title = metadata.get("title", "")
 
-                # Incrementar el identificador único para cada documento
-                doc_id = len(self.index.documents) + 1
+            # Incrementar el identificador único para cada documento
+            doc_id = len(self.index.documents) + 1
 
-                # Crear un nuevo objeto Document con los datos del archivo PDF
-                document = Document(id=doc_id, title=title, url="", text=text)
+            # Crear un nuevo objeto Document con los datos del archivo PDF
+            document = Document(id=doc_id, title=title, url="", text=text)
 
-                # Agregar el documento a la lista de documentos en el índice
-                self.index.documents.append(document)
-
-                # Limpiar y tokenizar el texto del documento
-                cleaned_text = self.parse(document.text)
-                tokens = self.tokenize(cleaned_text)
-
-                # Actualizar las posting lists en el index
-                self.update_postings(doc_id, tokens)
+            # Agregar el documento a la lista de documentos en el índice
+            self.index.documents.append(document)
 
         except Exception as e:
             print(f"Error al procesar PDF {filename}: {type(e).__name__} - {str(e)}")
             self.failed_pdfs.append(filename)  # Agregar a la lista de archivos PDF que fallan
             pass  # Ignorar el error y continuar con el siguiente archivo
 
-    def process_json(self, filename: str) -> None:
-        """Método para procesar archivos JSON."""
-        with open(os.path.join(self.args.input_folder, filename), "r", encoding="utf-8") as file:
-            data_list = json.load(file)
-
-            # Iterar sobre los datos en la lista
-            for data in data_list:
+    def process_pages(self, filename: str) -> None:
+        """Método para procesar la base de datos SQLite de páginas del crawler."""
+        connection = sqlite3.connect(os.path.join(self.args.input_folder, filename))
+        try:
+            # El cursor va leyendo las filas según se piden, sin cargarlas todas
+            for url, title, text in connection.execute("SELECT url, title, text FROM pages"):
                 # Generar un nuevo identificador de documento
                 doc_id = len(self.index.documents) + 1
 
-                # Crear un nuevo objeto Document con los datos del archivo JSON
-                document = Document(id=doc_id, title=data.get("title", ""), url=data["url"], text=data["text"])
+                # Crear un nuevo objeto Document con los datos de la página
+                document = Document(id=doc_id, title=title, url=url, text=text)
 
                 # Agregar el documento a la lista de documentos en el índice
                 self.index.documents.append(document)
-
-                # Limpiar y tokenizar el texto del documento
-                cleaned_text = self.parse(document.text)
-                tokens = self.tokenize(cleaned_text)
-
-                # Actualizar las posting lists en el index
-                self.update_postings(doc_id, tokens)
-    
-    def update_postings(self, doc_id: int, text: str) -> None:
-        """Método para actualizar las posting lists."""
-        words = self.tokenize(" ".join(text))
-        words = self.remove_stopwords(words)
-        words = [unidecode(word) for word in words]  # Quitar tildes
-        for word in set(words):
-            if word not in self.index.postings:
-                self.index.postings[word] = [doc_id]
-            else:
-                self.index.postings[word].append(doc_id)
-
-    def parse(self, text: str) -> str:
-        """Método para extraer el texto de un documento"""
-        # Utilizar BeautifulSoup para extraer solo el texto del bloque principal
-        soup = BeautifulSoup(text, "html.parser")
-        main_text = soup.get_text(separator=" ", strip=True)
-        return main_text
+        finally:
+            connection.close()
+
+    def analyze(self, text: str) -> Tuple[List[str], str]:
+        """Método para obtener los términos distintos de un documento y su
+        snippet: limpia, tokeniza (quitando tildes) y elimina stopwords. El
+        HTML se parsea una sola vez para las dos cosas."""
+        tree = LexborHTMLParser(text)
+        cleaned_text = self.parse(tree)
+        tokens = self.tokenize(cleaned_text)
+        words = self.remove_stopwords(tokens)
+        # dict.fromkeys elimina duplicados conservando el orden de aparición
+        return list(dict.fromkeys(words)), self.generate_snippet(tree, cleaned_text)
+
+    def update_postings(self, doc_id: int, terms: List[str]) -> None:
+        """Método para actualizar las posting lists con los términos
+        (sin repetir) de un documento."""
+        postings = self.postings
+        for term in terms:
+            postings[sys.intern(term)].append(doc_id)
+
+    def parse(self, tree: LexborHTMLParser) -> str:
+        """Método para extraer el texto de un documento ya parseado"""
+        # selectolax extrae el texto sin crear un objeto Python por cada etiqueta
+        node = tree.body or tree.root
+        return node.text(separator=" ", strip=True) if node is not None else ""
+
+    def generate_snippet(self, tree: LexborHTMLParser, cleaned_text: str) -> str:
+        """Genera el snippet que muestra el retriever: el texto de los tres
+        primeros encabezados o, si no hay, el principio del texto del
+        documento (el que devuelve parse)."""
+        headings = tree.css("h1, h2, h3, h4, h5, h6")
+        if headings:
+            snippet_text = " ".join(heading.text(separator=" ") for heading in headings[:3])
+        else:
+            snippet_text = cleaned_text
+        # Eliminar espacios en blanco adicionales y limitar a 150 caracteres
+        return " ".join(snippet_text.split())[:150]
 
     def tokenize(self, text: str) -> List[str]:
-        """Método para tokenizar un texto"""
-        # Dividimos el texto por espacios
-        return text.split()
+        """Método para tokenizar un texto. Devuelve las palabras en minúsculas
+        y sin tildes, ya sin signos de puntuación ni espacios duplicados."""
+        return _TOKEN_RE.findall(fold(text))
 
     def remove_stopwords(self, words: List[str]) -> List[str]:
-        """Método para eliminar stopwords después del tokenizado"""
-        # Elimina las stopwords de una lista de palabras
-        stop_words = set(stopwords.words("spanish"))
-        return [word for word in words if unidecode(word.lower()) not in stop_words]
+        """Método para eliminar stopwords después del tokenizado. Espera las
+        palabras ya en minúsculas y sin tildes."""
+        return [word for word in words if word not in _STOPWORDS]
 
     def remove_punctuation(self, text: str) -> str:
         """Método para eliminar signos de puntuación de un texto:
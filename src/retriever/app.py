@@ -1,4 +1,5 @@
 from argparse import ArgumentParser
+import logging
 
 from .retriever import Retriever
 
@@ -30,6 +31,24 @@ def parse_args():
         required=False,
     )
 
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=None,
+        help="Número de procesos para resolver las queries de un fichero"
+        " (por defecto, uno por CPU). Los ficheros con pocas queries se"
+        " resuelven siempre en un único proceso",
+        required=False,
+    )
+
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        action="store_true",
+        help="Muestra el tamaño de cada resultado intermedio al evaluar las queries",
+    )
+
     # Añade aquí cualquier otro argumento que condicione
     # el funcionamiento del retriever
 
@@ -47,6 +66,7 @@ def parse_args():
 
 if __name__ == "__main__":
     args = parse_args()
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO, format="%(message)s")
     retriever = Retriever(args)
     if args.query:
         retriever.search_query(args.query)
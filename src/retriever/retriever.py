@@ -1,12 +1,61 @@
-import pickle as pkl
+import logging
 import re
 from argparse import Namespace
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 from dataclasses import dataclass
 from time import time
-from typing import Dict, List
-from bs4 import BeautifulSoup
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from ..indexer.indexer import Index, fold
+from .evaluator import complement, difference, intersect, to_bitvector, to_ids, union
+
+logger = logging.getLogger(__name__)
+
+# Tipos de token de una query. Se comparan enteros en lugar de cadenas
+AND, OR, NOT, LPAREN, RPAREN, TERM = range(6)
+_TOKEN_KINDS = {"AND": AND, "OR": OR, "NOT": NOT, "(": LPAREN, ")": RPAREN}
+_OPERATOR_NAMES = {AND: "AND", OR: "OR", NOT: "NOT"}
+_PRECEDENCE = {NOT: 3, AND: 2, OR: 1}
+# Número de operandos de cada operador
+_ARITY = {NOT: 1, AND: 2, OR: 2}
+
+# Número mínimo de queries de un fichero para repartirlas en un pool de procesos
+_POOL_MIN_QUERIES = 256
+
+# Paréntesis, NOT (como palabra completa, para no partir términos como
+# "notas") y términos
+_QUERY_TOKEN_RE = re.compile(r"\(|\)|NOT\b|[^\s()]+")
+# Query formada por un único término, sin operadores ni paréntesis
+_SINGLE_TERM_RE = re.compile(r"(?!(?:AND|OR)$)(?!NOT\b)[^()]+")
+
+# Token de una query: (tipo, término). Los operadores no llevan término
+Token = Tuple[int, Optional[str]]
+# Nodo del árbol de una query: (TERM, término), (NOT, nodo) o
+# (AND / OR, tupla de nodos hijos)
+Node = Tuple[int, Any]
+
+
+class _LRUCache(OrderedDict):
+    """Diccionario con un número máximo de entradas: al llenarse descarta la
+    que lleva más tiempo sin usarse."""
+
+    def __init__(self, maxsize: int):
+        super().__init__()
+        self.maxsize = maxsize
+
+    def get(self, key: Any, default: Any = None) -> Any:
+        if key not in self:
+            return default
+        self.move_to_end(key)
+        return self[key]
+
+    def put(self, key: Any, value: Any) -> None:
+        self[key] = value
+        self.move_to_end(key)
+        if len(self) > self.maxsize:
+            self.popitem(last=False)
 
-from ..indexer.indexer import Index
 
 @dataclass
 class Result:
@@ -18,212 +67,310 @@ class Result:
     def __str__(self) -> str:
         return f"{self.url} -> {self.snippet}"
 
+
 class Retriever:
     """Clase que representa un recuperador"""
 
     def __init__(self, args: Namespace):
         self.args = args
         self.index = self.load_index()
+        # Las posting lists se convierten a bitvectors la primera vez que se usan,
+        # de forma que AND / OR / NOT son una única operación de enteros de
+        # CPython y arrancar no exige recorrer todo el índice
+        self.posting_bits: Dict[str, int] = {}
+        # Métodos de búsqueda guardados para no resolver los atributos por término
+        self._get_bits = self.posting_bits.get
+        self._get_posting = self.index.postings.get
+        # Bits 1..N activos: todos los documentos del índice
+        self._all_mask = ((1 << len(self.index.documents)) - 1) << 1
+        # Complementarios de los términos a los que se ha aplicado NOT
+        self._not_cache: Dict[str, int] = {}
+        # Tablas de despacho: qué método resuelve cada tipo de nodo
+        self._node_evaluators: Dict[int, Callable[[Node], int]] = {
+            TERM: self._evaluate_term,
+            NOT: self._evaluate_not,
+            AND: self._evaluate_cached,
+            OR: self._evaluate_cached,
+        }
+        self._combiners: Dict[int, Callable[[Tuple[Node, ...]], int]] = {
+            AND: self._evaluate_and,
+            OR: self._evaluate_or,
+        }
+        # Caché de resultados por query y caché de subexpresiones AND / OR
+        self._result_cache = _LRUCache(maxsize=4096)
+        self._subexpr_cache = _LRUCache(maxsize=1024)
 
     def search_query(self, query: str) -> List[Result]:
         """Método para resolver una query utilizando el algoritmo Shunting Yard."""
         print(f"Query: {query}")  # Agregar mensaje de depuración
-        query_terms = self.shunting_yard(query)
-        result_stack = []  # Agrega esta línea para inicializar la pila
-        final_results = self._evaluate_query(query_terms)
-    
+        final_result_ids, final_results = self._solve(query)
+        self._print_results(final_result_ids, final_results)
+
         # Devolver los resultados de la evaluación de la consulta
         return final_results
+
+    def _solve(self, query: str) -> Tuple[List[int], List[Result]]:
+        """Resuelve una query sin imprimir nada: devuelve los ids de los
+        documentos encontrados y sus resultados."""
+        tokens = query.split()
+        if len(tokens) == 1 and _SINGLE_TERM_RE.fullmatch(tokens[0]):
+            # Query de un solo término (el caso más habitual): no hace falta
+            # pasar por la notación posfija ni construir el árbol
+            return self._evaluate_tree((TERM, fold(tokens[0])))
+        return self._evaluate_query(self.shunting_yard(query))
     
-    def shunting_yard(self, query: str) -> List[str]:
+    def shunting_yard(self, query: str) -> List[Token]:
         """Implementación del algoritmo Shunting Yard para convertir la consulta a notación posfija."""
-        precedence = {"NOT": 3, "AND": 2, "OR": 1}
-        output = []
-        operator_stack = []
+        output: List[Token] = []
+        operator_stack: List[int] = []
 
         # Usar una expresión regular para dividir la consulta teniendo en cuenta los paréntesis y "NOT"
-        tokens = re.findall(r'\(|\)|NOT|[^\s()]+', query)
+        tokens = _QUERY_TOKEN_RE.findall(query)
 
         for token in tokens:
-            if token.isalnum():
-                output.append(token)
-            elif token in {"AND", "OR", "NOT"}:
+            kind = _TOKEN_KINDS.get(token, TERM)
+            if kind == TERM:
+                # Normalizar los términos igual que el indexer (minúsculas y sin tildes)
+                output.append((TERM, fold(token)))
+            elif kind == NOT or kind == LPAREN:
+                # NOT es un operador unario prefijo: todavía no hay operando que sacar
+                operator_stack.append(kind)
+            elif kind == RPAREN:
+                while operator_stack and operator_stack[-1] != LPAREN:
+                    output.append((operator_stack.pop(), None))
+                if operator_stack:
+                    operator_stack.pop()  # Pop el paréntesis de apertura
+            else:
                 while (
                     operator_stack
-                    and operator_stack[-1] != "("
-                    and precedence.get(operator_stack[-1], 0) >= precedence.get(token, 0)
+                    and operator_stack[-1] != LPAREN
+                    and _PRECEDENCE[operator_stack[-1]] >= _PRECEDENCE[kind]
                 ):
-                    output.append(operator_stack.pop())
-                operator_stack.append(token)
-            elif token == "(":
-                operator_stack.append(token)
-            elif token == ")":
-                while operator_stack and operator_stack[-1] != "(":
-                    output.append(operator_stack.pop())
-                if operator_stack and operator_stack[-1] == "(":
-                    operator_stack.pop()  # Pop el paréntesis de apertura
+                    output.append((operator_stack.pop(), None))
+                operator_stack.append(kind)
 
         while operator_stack:
-            output.append(operator_stack.pop())
+            kind = operator_stack.pop()
+            # Un paréntesis sin cerrar no aporta nada a la notación posfija
+            if kind != LPAREN:
+                output.append((kind, None))
 
         return output
 
     def search_from_file(self, fname: str) -> Dict[str, List[Result]]:
         """Método para hacer consultas desde fichero."""
         with open(fname, "r") as fr:
-            ts = time()
-            results_dict = {query.strip(): self.search_query(query.strip()) for query in fr}
-            te = time()
-            print(f"Time to solve {len(results_dict)} queries: {te-ts}")
-            return results_dict
+            # Cada línea se limpia una sola vez; se saltan las líneas vacías y
+            # las queries repetidas, que darían la misma entrada del resultado
+            queries = list(dict.fromkeys(query for query in map(str.strip, fr) if query))
+
+        ts = time()
+        # Cada proceso del pool vuelve a cargar el índice: con pocas queries
+        # sale más barato resolverlas aquí mismo
+        if self.args.workers == 1 or len(queries) < _POOL_MIN_QUERIES:
+            solved = [self._solve(query) for query in queries]
+        else:
+            # Las queries son independientes y el índice es de solo lectura:
+            # cada proceso mapea el mismo fichero y resuelve su parte
+            with ProcessPoolExecutor(
+                max_workers=self.args.workers, initializer=_init_worker, initargs=(self.args,)
+            ) as executor:
+                solved = list(executor.map(_run_query, queries, chunksize=32))
+
+        # Los resultados se imprimen aquí, en el orden del fichero
+        results_dict = {}
+        for query, (final_result_ids, results) in zip(queries, solved):
+            print(f"Query: {query}")
+            self._print_results(final_result_ids, results)
+            results_dict[query] = results
+        te = time()
+        print(f"Time to solve {len(results_dict)} queries: {te-ts}")
+        return results_dict
 
     def load_index(self) -> Index:
-        """Método para cargar un índice invertido desde disco."""
-        with open(self.args.index_file, "rb") as fr:
-            return pkl.load(fr)
-
-    def _and_(self, posting_a: List[int], posting_b: List[int]) -> List[int]:
-        """Método para calcular la intersección de dos posting lists."""
-        result = list(set(posting_a) & set(posting_b))
-        print(f"\nAND: {posting_a} AND {posting_b} = {result}")
+        """Método para cargar un índice invertido desde disco. El texto de los
+        documentos no se usa al buscar (el snippet ya está en el índice), así
+        que no se carga."""
+        return Index.load(self.args.index_file, load_text=False)
+
+    def _and_(self, *postings: int) -> int:
+        """Método para calcular la intersección de varias posting lists."""
+        result = intersect(postings)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("AND: sizes=%s -> %d", [p.bit_count() for p in postings], result.bit_count())
+        return result
+
+    def _or_(self, *postings: int) -> int:
+        """Método para calcular la unión de varias posting lists."""
+        result = union(postings)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("OR: sizes=%s -> %d", [p.bit_count() for p in postings], result.bit_count())
         return result
 
-    def _or_(self, posting_a: List[int], posting_b: List[int]) -> List[int]:
-        """Método para calcular la unión de dos posting lists."""
-        result = list(set(posting_a) | set(posting_b))
-        print(f"\nOR: {posting_a} OR {posting_b} = {result}")
+    def _and_not_(self, operand_a: int, operand_b: int) -> int:
+        """Calcula los documentos de operand_a que no están en operand_b."""
+        result = difference(operand_a, operand_b)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("ANDNOT: size=%d - %d -> %d", operand_a.bit_count(), operand_b.bit_count(), result.bit_count())
         return result
 
-    def _not_(self, operand_a: List[int]) -> List[int]:
+    def _not_(self, operand_a: int) -> int:
         """Calcula el complementario de una posting list."""
-        result = list(set(range(1, len(self.index.documents) + 1)) - set(operand_a))
-        print(f"\nNOT: ~{operand_a} = {result}")
+        result = complement(operand_a, self._all_mask)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("NOT: size=%d -> %d", operand_a.bit_count(), result.bit_count())
         return result
 
-    # Método para la evaluación de la consulta 
-    def _evaluate_query(self, query_terms):
-        result_stack = []  # Pila para almacenar resultados intermedios
-        operator_stack = []  # Pila para almacenar operadores
-        inside_parenthesis = 0  # Variable para rastrear la profundidad de los paréntesis
-
-        for term in query_terms:
-            # Si el término es un término de búsqueda (un token en los documentos)
-            if term in self.index.postings:
-                posting_list = self.index.postings[term]
-                print(f"\nposting['{term}'] = {posting_list} (doc ids que tienen '{term}')")
-                result_stack.append(posting_list)  # Agrega la lista de documentos que contienen el término a la pila de resultados
-            # Si el término es "NOT"
-            elif term == "NOT":
-                operator_stack.append("NOT")  # Agrega "NOT" a la pila de operadores
-            # Si el término es "AND" o "OR"
-            elif term in {"AND", "OR"}:
-                while (
-                    operator_stack
-                    and operator_stack[-1] in {"AND", "OR"}
-                    and inside_parenthesis == 0
-                ):
-                    operator = operator_stack.pop()  # Obtiene el último operador de la pila de operadores
-                    if operator == "NOT":
-                        operand_a = result_stack.pop()  # Obtiene el operando de la pila de resultados
-                        result = self._not_(operand_a)
-                    else:
-                        operand_b = result_stack.pop()  # Obtiene el segundo operando de la pila de resultados
-                        operand_a = result_stack.pop()  # Obtiene el primer operando de la pila de resultados
-                        if operator == "AND":
-                            result = self._and_(operand_a, operand_b)
-                        elif operator == "OR":
-                            result = self._or_(operand_a, operand_b)
-                    result_stack.append(result)  # Agrega el resultado de la operación a la pila de resultados
-                operator_stack.append(term)  # Agrega "AND" o "OR" a la pila de operadores
-            # Si el término es "("
-            elif term == "(":
-                inside_parenthesis += 1
-            # Si el término es ")"
-            elif term == ")":
-                inside_parenthesis -= 1
-                while operator_stack and operator_stack[-1] != "(":
-                    operator = operator_stack.pop()  # Obtiene el último operador de la pila de operadores
-                    if operator == "NOT":
-                        operand_a = result_stack.pop()  # Obtiene el operando de la pila de resultados
-                        result = self._not_(operand_a)
-                    elif operator in {"AND", "OR"}:
-                        operand_b = result_stack.pop()  # Obtiene el segundo operando de la pila de resultados
-                        operand_a = result_stack.pop()  # Obtiene el primer operando de la pila de resultados
-                        if operator == "AND":
-                            result = self._and_(operand_a, operand_b)
-                        elif operator == "OR":
-                            result = self._or_(operand_a, operand_b)
-                    result_stack.append(result)  # Agrega el resultado de la operación a la pila de resultados
-                operator_stack.pop()  # Elimina el "(" de la pila de operadores
-            # Si el término es un espacio en blanco, ignóralo
-            elif term == " ":
+    def _build_tree(self, query_terms: List[Token]) -> Optional[Node]:
+        """Construye el árbol de la query a partir de su notación posfija.
+        Las cadenas de un mismo operador asociativo (a AND b AND c) se agrupan
+        en un único nodo n-ario para resolverlas en una sola operación."""
+        stack: List[Node] = []
+        for kind, term in query_terms:
+            # Una única búsqueda en la tabla distingue términos y operadores
+            arity = _ARITY.get(kind)
+            if arity is None:
+                stack.append((TERM, term))
                 continue
+            if len(stack) < arity:
+                print(f"ERROR: Operador '{_OPERATOR_NAMES[kind]}' sin suficientes operandos.")
+                return None
+            if arity == 1:
+                stack.append((kind, stack.pop()))
+                continue
+            operand_b = stack.pop()
+            operand_a = stack.pop()
+            children: List[Node] = []
+            for child in (operand_a, operand_b):
+                if child[0] == kind:
+                    children.extend(child[1])
+                else:
+                    children.append(child)
+            # Hijos en orden canónico: "a AND b" y "b AND a" dan el mismo
+            # nodo y comparten entrada en las cachés
+            stack.append((kind, tuple(sorted(children))))
 
-        # Procesa los operadores y operandos restantes en la pila
-        while operator_stack:
-            operator = operator_stack.pop()  # Obtiene el último operador de la pila de operadores
-
-            # Si el operador es "NOT", realiza la operación correspondiente
-            if operator == "NOT":
-                if not result_stack:
-                    print("ERROR: Operador 'NOT' sin suficientes operandos.")
-                    return []
-                operand_a = result_stack.pop()  # Obtiene el operando de la pila de resultados
-                result = self._not_(operand_a)
-                result_stack.append(result)  # Agrega el resultado de la operación a la pila de resultados
-
-            # Si el operador es "AND" o "OR", agrega el operador a la pila de resultados
-            elif operator in {"AND", "OR"}:
-                if operator == "OR" and len(result_stack) < 2:
-                    print(f"ERROR: Operador 'OR' sin suficientes operandos.")
-                    return []
-                elif operator == "AND" and len(result_stack) < 2:
-                    print(f"ERROR: Operador 'AND' sin suficientes operandos.")
-                    return []
-
-                operand_b = result_stack.pop()  # Obtiene el segundo operando de la pila de resultados
-                operand_a = result_stack.pop()  # Obtiene el primer operando de la pila de resultados
-                if operator == "AND":
-                    result = self._and_(operand_a, operand_b)
-                elif operator == "OR":
-                    result = self._or_(operand_a, operand_b)
-                result_stack.append(result)  # Agrega el resultado de la operación a la pila de resultados
-
-        # Procesa la pila de resultados para obtener el resultado final
-        if result_stack and isinstance(result_stack[0], list):
-            final_result_ids = result_stack[0]
-            print(f"\nFinal Result IDs: {final_result_ids}\n")
+        if len(stack) != 1:
+            print("ERROR: Operadores sin operandos suficientes.")
+            return None
+        return stack[0]
+
+    def _evaluate_node(self, node: Node) -> int:
+        """Resuelve un nodo del árbol de la query y devuelve su bitvector."""
+        return self._node_evaluators[node[0]](node)
+
+    def _evaluate_term(self, node: Node) -> int:
+        posting_list = self._term_bits(node[1])
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Term: %s size=%d", node[1], posting_list.bit_count())
+        return posting_list
+
+    def _evaluate_not(self, node: Node) -> int:
+        operand = node[1]
+        if operand[0] != TERM:
+            return self._not_(self._evaluate_node(operand))
+        # "NOT término" se calcula una sola vez y se reutiliza entre queries
+        result = self._not_cache.get(operand[1])
+        if result is None:
+            result = self._not_(self._evaluate_term(operand))
+            self._not_cache[operand[1]] = result
+        return result
+
+    def _evaluate_cached(self, node: Node) -> int:
+        # Las subexpresiones AND / OR se guardan en caché para reutilizarlas
+        # entre queries que las compartan
+        result = self._subexpr_cache.get(node)
+        if result is None:
+            result = self._combiners[node[0]](node[1])
+            self._subexpr_cache.put(node, result)
+        return result
+
+    def _evaluate_or(self, children: Tuple[Node, ...]) -> int:
+        """Resuelve la unión de los hijos de un nodo OR."""
+        return self._or_(*[self._evaluate_node(child) for child in children])
+
+    def _term_bits(self, term: str) -> int:
+        """Devuelve el bitvector de un término, convirtiendo su posting list
+        solo la primera vez."""
+        bits = self._get_bits(term)
+        if bits is None:
+            posting = self._get_posting(term)
+            # Un término que no aparece en ningún documento es un bitvector vacío
+            if posting is None:
+                return 0
+            bits = self.posting_bits[term] = to_bitvector(posting)
+        return bits
+
+    def _evaluate_and(self, children: Tuple[Node, ...]) -> int:
+        """Resuelve la intersección de los hijos de un nodo AND. Los hijos
+        NOT no se complementan: "a AND NOT b" se resuelve como a - b, sin
+        pasar por el conjunto de todos los documentos."""
+        positives = [child for child in children if child[0] != NOT]
+        negatives = [child[1] for child in children if child[0] == NOT]
+        if not positives:
+            # NOT a AND NOT b = NOT (a OR b): un único complementario
+            return self._not_(self._or_(*[self._evaluate_node(child) for child in negatives]))
+
+        # Los términos se resuelven primero porque son baratos: si alguno no
+        # aparece en ningún documento, la intersección es vacía y no hace
+        # falta evaluar el resto de subexpresiones
+        operands = []
+        for child in sorted(positives, key=lambda child: child[0] != TERM):
+            operand = self._evaluate_node(child)
+            if not operand:
+                return 0
+            operands.append(operand)
+        result = self._and_(*operands)
 
+        for child in negatives:
+            if not result:
+                break
+            result = self._and_not_(result, self._evaluate_node(child))
+        return result
+
+    # Método para la evaluación de la consulta
+    def _evaluate_query(self, query_terms: List[Token]) -> Tuple[List[int], List[Result]]:
+        tree = self._build_tree(query_terms)
+        if tree is None:
+            return [], []
+        return self._evaluate_tree(tree)
+
+    def _evaluate_tree(self, tree: Node) -> Tuple[List[int], List[Result]]:
+        # El árbol canónico identifica la query: las que solo se diferencian
+        # en mayúsculas, espacios u orden de los operandos comparten resultado
+        cached = self._result_cache.get(tree)
+        if cached is None:
+            # Solo se pasa de bitvector a lista de ids al final
+            final_result_ids = to_ids(self._evaluate_node(tree))
             # Recupera la URL y el snippet de cada documento
             results = [self._get_result_info(doc_id) for doc_id in final_result_ids]
-            # Imprime la URL y el snippet de cada documento final
-            for doc_id in final_result_ids:
-                result = self._get_result_info(doc_id)
-                print(f"ID: {[doc_id]} \nURL: {result.url}\nSnippet: {result.snippet}\n")
-            return results
-        else:
-            print("ERROR: Operadores sin operandos suficientes.")
-            return []
+            cached = (final_result_ids, results)
+            self._result_cache.put(tree, cached)
+        return cached
+
+    def _print_results(self, final_result_ids: List[int], results: List[Result]) -> None:
+        """Imprime los ids, la URL y el snippet de cada documento final."""
+        print(f"\nFinal Result IDs: {final_result_ids}\n")
+        for doc_id, result in zip(final_result_ids, results):
+            print(f"ID: {[doc_id]} \nURL: {result.url}\nSnippet: {result.snippet}\n")
 
     def _get_result_info(self, doc_id: int) -> Result:
-        """Obtiene la información real de un documento."""
+        """Obtiene la información real de un documento. El snippet ya viene
+        calculado en el índice."""
         document = self.index.documents[doc_id - 1]
-        url = document.url
-        snippet = self._generate_snippet(document.text)  
-        return Result(url=url, snippet=snippet)
-
-    def _generate_snippet(self, content: str) -> str:
-        """Genera un snippet a partir del contenido del documento."""
-        soup = BeautifulSoup(content, 'html.parser')
-        paragraphs = soup.find_all(['h1', 'h2', 'h3', 'h4', 'h5', 'h6'])
-
-        if paragraphs:
-            # Tomar el texto de los primeros tres párrafos
-            snippet_text = ' '.join([p.get_text() for p in paragraphs[:3]])
-            # Eliminar espacios en blanco adicionales
-            snippet_text = ' '.join(snippet_text.split())
-            # Limitar la longitud del snippet a 150 caracteres
-            return snippet_text[:150]     
-        else:
-            # Si no hay párrafos, simplemente tomar los primeros 150 caracteres y eliminar espacios en blanco adicionales
-            return ' '.join(content[:150].split())
\ No newline at end of file
+        return Result(url=document.url, snippet=document.snippet)
+
+
+# Retriever propio de cada proceso del pool; se crea una vez por proceso en
+# _init_worker, mapeando el índice en lugar de enviarlo con cada query
+_worker_retriever: Optional[Retriever] = None
+
+
+def _init_worker(args: Namespace) -> None:
+    global _worker_retriever
+    _worker_retriever = Retriever(args)
+
+
+def _run_query(query: str) -> Tuple[List[int], List[Result]]:
+    assert _worker_retriever is not None, "_init_worker no se ha ejecutado"
+    return _worker_retriever._solve(query)